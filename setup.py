@@ -20,8 +20,8 @@ else:
         version="0.3",
         packages=find_packages(),
         install_requires=[
-            "numpy",
-            "scipy",
+            "numpy>=1.17",
+            "scipy>=1.8",
             "matplotlib",
             "h5py",
             "pandas",
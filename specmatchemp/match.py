@@ -4,18 +4,42 @@
 Defines the Match class
 """
 
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
 import h5py
 import numpy as np
 import matplotlib.pyplot as plt
 import lmfit
-from scipy.interpolate import LSQUnivariateSpline
-from scipy.ndimage.filters import convolve1d
+from scipy import fft as sp_fft
+from scipy.interpolate import BSpline
+from scipy.optimize import least_squares, minimize
+from scipy.signal import oaconvolve
 
 import specmatchemp.kernels
 from specmatchemp import spectrum
 from specmatchemp.spectrum import Spectrum
 from specmatchemp import plots
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
+SPEED_OF_LIGHT = 2.99792e5  # km/s
+KERNEL_POINTS = 151         # fixed number of points in the broadening kernel
+# Below this many pixels in total (summed over all rows), direct convolution
+# (if numba is available) is faster than overlap-add FFT convolution with a
+# kernel of KERNEL_POINTS points. Benchmark (direct vs oa, in us):
+#   1-D: 1000 px 80 vs 109, 1500 px 120 vs 182, 2000 px 146 vs 161,
+#        2500 px 178 vs 179, 3000 px 211 vs 186
+#   2 rows: 2x500 87 vs 119, 2x750 119 vs 124, 2x1000 154 vs 130,
+#           2x1500 217 vs 210
+# The cost of oa grows slowly with the number of rows, so the threshold is
+# applied to the total size and set where both cases still favour direct.
+DIRECT_CONV_MAX = 1500
+
 
 class Match(object):
     """The Match class used for matching two spectra
@@ -42,54 +66,95 @@ class Match(object):
         if not np.allclose(target.w, reference.w):
             print("Target and reference are on different wavelength scales.")
             raise ValueError
-        # common wavelength scale
-        self.w = np.copy(target.w)
-
         # target, reference and modified spectra
         self.target = target.copy()
         self.reference = reference.copy()
         self.modified = reference.copy()
 
+        # common wavelength scale, shared with the target copy
+        self.w = self.target.w
+        # velocity spacing between pixels (km/s)
+        self._dv = (self.w[1]-self.w[0])/self.w[0]*SPEED_OF_LIGHT
+
         # replace nans with continuum
         self.target.s[np.isnan(self.target.s)] = 1
         self.target.serr[np.isnan(self.target.serr)] = 1
         self.reference.s[np.isnan(self.reference.s)] = 1
         self.reference.serr[np.isnan(self.reference.serr)] = 1
+        # squared target error, constant over the fit
+        self._serr_targ_sq = self.target.serr**2
+        # work buffers for the objective function
+        self._res_buf = np.empty_like(self.w)
+        self._den_buf = np.empty_like(self.w)
+        # reference flux and error, stacked so that both can be broadened in a
+        # single convolution
+        self._ref_stack = np.nan_to_num(np.vstack([self.reference.s,
+                                                   self.reference.serr]))
 
         self.best_params = lmfit.Parameters()
         self.best_chisq = np.NaN
         self.mode = mode
         self.opt = opt
 
-        # add spline knots
-        num_knots = 5
-        interval = int(len(self.w)/(num_knots+1))
-        # Add spline positions
-        self.knot_x = []
-        for i in range(1, num_knots+1):
-            self.knot_x.append(self.w[interval*i])
-        self.knot_x = np.array(self.knot_x)
+        # add spline knots. The knots and spline basis depend only on the
+        # wavelength scale, so they are shared between Match objects.
+        self.knot_x, self._spl_q = spline_setup(self.w)
 
-    def create_model(self, params):
+    def create_model(self, params, model_err=True):
         """
         Creates a tweaked model based on the parameters passed,
         based on the reference spectrum.
         Stores the tweaked model in spectra.s_mod and serr_mod.
+
+        Args:
+            params (lmfit.Parameters): parameters
+            model_err (bool, optional): Whether to also compute the error of
+                the model. If False, modified.serr is left untouched.
         """
-        self.modified.s = np.nan_to_num(self.reference.s)
-        self.modified.serr = np.nan_to_num(self.reference.serr)
+        self._create_model(params['vsini'].value, model_err)
+
+    def _create_model(self, vsini, model_err=True):
+        """Creates the model for the given vsini, without going through an
+        lmfit.Parameters object.
 
+        Args:
+            vsini (float): vsini to broaden the reference by
+            model_err (bool, optional): Whether to also compute the error of
+                the model.
+        """
         # Apply broadening kernel
-        vsini = params['vsini'].value
-        self.modified = self.broaden(vsini, self.modified)
+        kernel = self._get_kernel(vsini)
+        if model_err:
+            model = convolve_reflect(self._ref_stack, kernel[np.newaxis, :])
+            s_mod = model[0]
+        else:
+            model = convolve_reflect(self._ref_stack[0], kernel)
+            s_mod = model
 
         # Use linear least squares to fit a spline
-        spline = LSQUnivariateSpline(self.w, self.target.s / self.modified.s,
-                                     self.knot_x)
-        self.spl = spline(self.w)
+        self.spl = self.fit_spline(self.target.s / s_mod)
+
+        # Scale flux and error by the spline in a single pass
+        model *= self.spl
+        if model_err:
+            self.modified.s, self.modified.serr = model
+        else:
+            self.modified.s = model
+
+    def fit_spline(self, y):
+        """Fits a cubic spline with knots at self.knot_x to the given data by
+        linear least squares, using the precomputed spline basis.
 
-        self.modified.s *= self.spl
-        self.modified.serr *= self.spl
+        Equivalent to LSQUnivariateSpline(self.w, y, self.knot_x)(self.w).
+
+        Args:
+            y (np.ndarray): Data to fit, on the wavelength scale self.w
+        Returns:
+            spl (np.ndarray): Spline evaluated on self.w
+        """
+        # The least-squares fit evaluated on self.w is the projection of y
+        # onto the spline space, Q Q^T y for an orthonormal basis Q.
+        return self._spl_q.T.dot(self._spl_q.dot(y))
 
     def load_params(self, params):
         """
@@ -98,6 +163,7 @@ class Match(object):
         """
         self.best_chisq = self.objective(params)
         self.best_params = params
+        self.create_model(params)
 
     def broaden(self, vsini, spec):
         """
@@ -109,17 +175,26 @@ class Match(object):
         Returns:
             broadened (Spectrum): Broadened spectrum
         """
-        SPEED_OF_LIGHT = 2.99792e5
-        dv = (self.w[1]-self.w[0])/self.w[0]*SPEED_OF_LIGHT
-        n = 151     # fixed number of points in the kernel
-        varr, kernel = specmatchemp.kernels.rot(n, dv, vsini)
-        # broadened = signal.fftconvolve(spec, kernel, mode='same')
+        kernel = self._get_kernel(vsini)
 
-        spec.s = convolve1d(spec.s, kernel)
-        spec.serr = convolve1d(spec.serr, kernel)
+        spec.s = convolve_reflect(spec.s, kernel)
+        spec.serr = convolve_reflect(spec.serr, kernel)
 
         return spec
 
+    def _get_kernel(self, vsini):
+        """Gets the rotational broadening kernel for the given vsini.
+
+        Kernels are cached, so repeated evaluations at the same vsini (common
+        during the fit) do not rebuild the kernel.
+
+        Args:
+            vsini (float): vsini to determine width of broadening
+        Returns:
+            kernel (np.ndarray): Broadening kernel
+        """
+        return _rot_cached(KERNEL_POINTS, self._dv, vsini)[1]
+
     def objective(self, params):
         """
         Objective function evaluating goodness of fit given the passed
@@ -131,21 +206,51 @@ class Match(object):
             Reduced chi-squared value between the target spectra and the
             model spectrum generated by the parameters
         """
-        self.create_model(params)
-
-        # Calculate residuals (data - model)
-        if self.mode == 'normalized':
-            residuals = ((self.target.s - self.modified.s) /
-                         np.sqrt(self.target.serr**2 + self.modified.serr**2))
-        else:
-            residuals = (self.target.s - self.modified.s)
-
-        chi_square = np.sum(residuals**2)
+        # The model error only enters the normalized chi-square
+        self.create_model(params, model_err=(self.mode == 'normalized'))
 
         if self.opt == 'lm':
-            return residuals
+            return self._residuals()
         elif self.opt == 'nelder':
-            return chi_square
+            # Only the chi-square is returned, so the residuals can be
+            # written into a reusable buffer. The dot product avoids a
+            # further temporary array.
+            residuals = self._residuals(out=self._res_buf)
+            return residuals.dot(residuals)
+
+    def _obj_vec(self, x):
+        """Residuals for scipy.optimize.least_squares, which works directly
+        on a parameter array rather than lmfit.Parameters.
+
+        Args:
+            x (np.ndarray): [vsini]
+        Returns:
+            residuals (np.ndarray)
+        """
+        self._create_model(x[0], model_err=(self.mode == 'normalized'))
+
+        # least_squares keeps earlier residual arrays around, so these must
+        # not be written into a shared buffer.
+        return self._residuals()
+
+    def _residuals(self, out=None):
+        """Residuals (data - model) between the target and current model.
+
+        Args:
+            out (np.ndarray, optional): Array to write the residuals into.
+                A new array is allocated if not given.
+        Returns:
+            np.ndarray
+        """
+        residuals = np.subtract(self.target.s, self.modified.s, out=out)
+        if self.mode == 'normalized':
+            denom = np.multiply(self.modified.serr, self.modified.serr,
+                                out=self._den_buf)
+            denom += self._serr_targ_sq
+            np.sqrt(denom, out=denom)
+            residuals /= denom
+
+        return residuals
 
     def best_fit(self, params=None):
         """
@@ -164,13 +269,21 @@ class Match(object):
 
         # Perform fit
         if self.opt == 'lm':
-            out = lmfit.minimize(self.objective, params)
-            self.best_chisq = np.sum(self.objective(out.params)**2)
+            # vsini is the only free parameter, so call scipy directly rather
+            # than going through lmfit on every step.
+            vsini = params['vsini']
+            out = least_squares(self._obj_vec, x0=[vsini.value],
+                                bounds=([vsini.min], [vsini.max]))
+            vsini.value = out.x[0]
+            self.best_chisq = out.fun.dot(out.fun)
+            self.best_params = params
         elif self.opt == 'nelder':
             out = lmfit.minimize(self.objective, params, method='nelder')
             self.best_chisq = self.objective(out.params)
+            self.best_params = out.params
 
-        self.best_params = out.params
+        # Store the full model, including its error
+        self.create_model(self.best_params)
 
         return self.best_chisq
 
@@ -181,11 +294,7 @@ class Match(object):
         Returns:
             np.ndarray
         """
-        if self.mode == 'normalized':
-            return ((self.target.s - self.modified.s) /
-                    np.sqrt(self.target.serr**2 + self.modified.serr**2))
-        else:
-            return (self.target.s - self.modified.s)  # data - model
+        return self._residuals()
 
     def get_spline_positions(self):
         """Wrapper function for getting spline positions
@@ -324,23 +433,34 @@ class MatchLincomb(Match):
                       "wavelength scales.")
                 raise ValueError
 
-        self.w = np.copy(target.w)
         self.target = target.copy()
+        self.w = self.target.w
+        self._serr_targ_sq = self.target.serr**2
+        self._res_buf = np.empty_like(self.w)
+        self._den_buf = np.empty_like(self.w)
+        self._dv = (self.w[1]-self.w[0])/self.w[0]*SPEED_OF_LIGHT
         self.num_refs = len(refs)
-        self.refs = []
-        for i in range(self.num_refs):
-            self.refs.append(refs[i].copy())
+        # The references are never modified, so they need not be copied.
+        self.refs = list(refs)
 
         self.ref_chisq = ref_chisq
 
         self.vsini = vsini
 
-        # Broaden reference spectra
-        self.refs_broadened = []
-        for i in range(self.num_refs):
-            self.refs_broadened.append(self.refs[i].copy())
-            self.refs_broadened[i] = self.broaden(vsini[i],
-                                                  self.refs_broadened[i])
+        # Broaden reference spectra. All references (flux and error) are
+        # convolved in a single batched FFT, one kernel per reference, with
+        # each kernel transformed once and applied to both flux and error.
+        kernels = np.array([self._get_kernel(v) for v in vsini])
+        stack = np.array([[r.s for r in self.refs],
+                          [r.serr for r in self.refs]])
+        stack = convolve_reflect(stack, kernels[np.newaxis],
+                                 method='fft')
+
+        # Broadened fluxes and errors, each a contiguous array of shape
+        # (num_refs, len(w)), so that the linear combination is a single
+        # matrix-vector product.
+        self._S = np.ascontiguousarray(stack[0])
+        self._E = np.ascontiguousarray(stack[1])
 
         self.modified = Spectrum(self.w, np.zeros_like(self.w),
                                  name='Linear Combination {0:d}'
@@ -351,38 +471,69 @@ class MatchLincomb(Match):
         self.mode = mode
         self.opt = 'nelder'
 
-        # add spline knots
-        num_knots = 5
-        interval = int(len(self.w)/(num_knots+1))
-        # Add spline positions
-        self.knot_x = []
-        for i in range(1, num_knots+1):
-            self.knot_x.append(self.w[interval*i])
-        self.knot_x = np.array(self.knot_x)
+        # add spline knots. The knots and spline basis depend only on the
+        # wavelength scale, so they are shared between Match objects.
+        self.knot_x, self._spl_q = spline_setup(self.w)
 
-    def create_model(self, params):
+        # lincomb coefficient parameter names, and a buffer to read their
+        # values into on every objective evaluation
+        self._coeff_keys = ['coeff_{0:d}'.format(i)
+                            for i in range(self.num_refs)]
+        self._coeff_buf = np.empty(self.num_refs)
+
+    @property
+    def refs_broadened(self):
+        """list of Spectrum: Broadened reference spectra, as views onto the
+        rows of the broadened flux and error arrays.
+        """
+        return [Spectrum(self.w, self._S[i], self._E[i], mask=r.mask,
+                         name=r.name, header=r.header, attrs=r.attrs)
+                for i, r in enumerate(self.refs)]
+
+    def _read_coeffs(self, params):
+        """Reads the lincomb coefficients from params into self._coeff_buf.
+
+        Args:
+            params (lmfit.Parameters): parameters
+        Returns:
+            coeffs (np.ndarray): self._coeff_buf
+        """
+        for i, k in enumerate(self._coeff_keys):
+            self._coeff_buf[i] = params[k].value
+
+        return self._coeff_buf
+
+    def create_model(self, params, model_err=True):
         """
         Creates a tweaked model based on the parameters passed,
         based on the reference spectrum.
         Stores the tweaked model in spectra.s_mod and serr_mod.
+
+        Args:
+            params (lmfit.Parameters): parameters
+            model_err (bool, optional): Whether to also compute the error of
+                the model. If False, modified.serr is left untouched.
         """
-        self.modified.s = np.zeros_like(self.w)
-        self.modified.serr = np.zeros_like(self.w)
+        self._create_model(self._read_coeffs(params), model_err)
 
-        # create the model from a linear combination of the reference spectra
-        coeffs = get_lincomb_coeffs(params)
+    def _create_model(self, coeffs, model_err=True):
+        """Creates the model for the given lincomb coefficients, without
+        going through an lmfit.Parameters object.
 
-        for i in range(self.num_refs):
-            self.modified.s += self.refs_broadened[i].s * coeffs[i]
-            self.modified.serr += self.refs_broadened[i].serr * coeffs[i]
+        Args:
+            coeffs (np.ndarray): Coefficients of the reference spectra
+            model_err (bool, optional): Whether to also compute the error of
+                the model.
+        """
+        # create the model from a linear combination of the reference spectra
+        s_mod = coeffs.dot(self._S)
 
         # Use linear least squares to fit a spline
-        spline = LSQUnivariateSpline(self.w, self.target.s / self.modified.s,
-                                     self.knot_x)
-        self.spl = spline(self.w)
+        self.spl = self.fit_spline(self.target.s / s_mod)
 
-        self.modified.s *= self.spl
-        self.modified.serr *= self.spl
+        self.modified.s = np.multiply(s_mod, self.spl)
+        if model_err:
+            self.modified.serr = np.multiply(coeffs.dot(self._E), self.spl)
 
     def objective(self, params):
         """Objective function evaluating goodness of fit given the passed
@@ -394,22 +545,48 @@ class MatchLincomb(Match):
             Reduced chi-squared value between the target spectra and the
             model spectrum generated by the parameters
         """
-        chi_square = super(MatchLincomb, self).objective(params)
+        return self._obj_vec(self._read_coeffs(params))
+
+    def _obj_vec(self, coeffs):
+        """Objective function for scipy.optimize.minimize, which works
+        directly on the array of lincomb coefficients.
+
+        Args:
+            coeffs (np.ndarray): Coefficients of the reference spectra
+        Returns:
+            chi_square (float)
+        """
+        self._create_model(coeffs, model_err=(self.mode == 'normalized'))
+
+        residuals = self._residuals(out=self._res_buf)
+        chi_square = residuals.dot(residuals)
 
         # Add a Gaussian prior
-        sum_coeff = np.sum(get_lincomb_coeffs(params))
+        sum_coeff = coeffs.sum()
 
         WIDTH = 1e-2
         chi_square += (sum_coeff - 1)**2 / (2 * WIDTH**2)
 
         return chi_square
 
-    def best_fit(self):
+    def best_fit(self, n_restarts=1, n_jobs=None, seed=None):
         """
         Calculates the best fit model by minimizing over the parameters:
         - Coefficients of reference spectra
         - spline fitting to the continuum
         - rotational broadening
+
+        Args:
+            n_restarts (int, optional): Number of independent Nelder-Mead
+                runs. The first starts from equal coefficients, the rest from
+                coefficients drawn from a flat Dirichlet distribution. The
+                run with the lowest chi-squared is kept.
+            n_jobs (int, optional): Number of worker processes used for the
+                restarts, capped at n_restarts. Defaults to the number of
+                CPUs; 1 runs them serially. Starting the workers has a fixed
+                cost, so the process pool only pays off for long spectra or
+                many references.
+            seed (int, optional): Seed for drawing the starting points.
         """
         params = lmfit.Parameters()
 
@@ -422,12 +599,32 @@ class MatchLincomb(Match):
         # vsini
         params = add_vsini(params, self.vsini)
 
-        # Minimize chi-squared
-        out = lmfit.minimize(self.objective, params, method='nelder')
+        # Minimize chi-squared over the coefficients directly, rather than
+        # through lmfit, which is costly on every objective evaluation.
+        starts = [np.array([params[k].value for k in self._coeff_keys])]
+        if n_restarts > 1:
+            rng = np.random.default_rng(seed)
+            starts += list(rng.dirichlet(np.ones(self.num_refs),
+                                         n_restarts - 1))
+
+        if len(starts) == 1 or n_jobs == 1:
+            results = [_lincomb_nelder_mead(self, x0) for x0 in starts]
+        else:
+            # Each run is independent, so they can use separate processes.
+            # The Match object is sent once to each worker, not per run.
+            max_workers = min(n_jobs or os.cpu_count() or 1, len(starts))
+            with ProcessPoolExecutor(max_workers=max_workers,
+                                     initializer=_init_lincomb_worker,
+                                     initargs=(self,)) as executor:
+                results = list(executor.map(_lincomb_worker_run, starts))
+        best_x, best_fun = min(results, key=lambda r: r[1])
 
         # Save best fit parameters
-        self.best_params = out.params
+        for k, c in zip(self._coeff_keys, best_x):
+            params[k].value = c
+        self.best_params = params
         self.best_chisq = self.objective(self.best_params)
+        self.create_model(self.best_params)
         self.coeffs = self.get_lincomb_coeffs()
 
         return self.best_chisq
@@ -587,6 +784,198 @@ class MatchLincomb(Match):
         return mt
 
 
+def _lincomb_nelder_mead(mt, x0):
+    """Runs a single Nelder-Mead minimization of the objective of a
+    MatchLincomb object over its lincomb coefficients.
+
+    Defined at module level so that it can be sent to worker processes.
+
+    Args:
+        mt (MatchLincomb): Match object
+        x0 (np.ndarray): Initial coefficients
+    Returns:
+        x (np.ndarray): Best-fit coefficients
+        fun (float): Objective at x
+    """
+    out = minimize(mt._obj_vec, x0, method='Nelder-Mead',
+                   bounds=[(0., 1.)] * mt.num_refs,
+                   options={'maxfev': 2000 * (mt.num_refs + 1)})
+
+    return out.x, out.fun
+
+
+# MatchLincomb object held by each worker process during parallel restarts
+_worker_match = None
+
+
+def _init_lincomb_worker(mt):
+    """Stores the MatchLincomb object in a worker process.
+
+    Args:
+        mt (MatchLincomb): Match object
+    """
+    global _worker_match
+    _worker_match = mt
+
+
+def _lincomb_worker_run(x0):
+    """Runs _lincomb_nelder_mead on the worker's MatchLincomb object.
+
+    Args:
+        x0 (np.ndarray): Initial coefficients
+    Returns:
+        x (np.ndarray): Best-fit coefficients
+        fun (float): Objective at x
+    """
+    return _lincomb_nelder_mead(_worker_match, x0)
+
+
+@lru_cache(maxsize=128)
+def _rot_cached(n, dv, vsini):
+    """Cached wrapper around specmatchemp.kernels.rot.
+
+    The returned arrays are shared between callers and are set read-only.
+
+    Args:
+        n (int): Number of points in the kernel
+        dv (float): Spacing between kernel points (km/s)
+        vsini (float): Projected rotational velocity (km/s)
+    Returns:
+        varr (np.ndarray): Velocities
+        kernel (np.ndarray): Broadening kernel
+    """
+    varr, kernel = specmatchemp.kernels.rot(n, dv, vsini)
+    varr.flags.writeable = False
+    kernel.flags.writeable = False
+
+    return varr, kernel
+
+
+def spline_setup(w, num_knots=5):
+    """Places the spline knots and builds the spline basis for a wavelength
+    scale.
+
+    Results are cached on the contents of w, so Match objects on the same
+    wavelength scale (e.g. when matching against a whole library) share one
+    basis. The returned arrays must not be modified.
+
+    Args:
+        w (np.ndarray): Wavelength scale
+        num_knots (int, optional): Number of interior knots
+    Returns:
+        knotx (np.ndarray): Interior knot positions
+        q (np.ndarray): See spline_basis
+    """
+    w = np.ascontiguousarray(w, dtype=np.float64)
+    return _spline_setup_cached(w.tobytes(), num_knots)
+
+
+@lru_cache(maxsize=8)
+def _spline_setup_cached(w_bytes, num_knots):
+    w = np.frombuffer(w_bytes, dtype=np.float64)
+
+    interval = int(len(w)/(num_knots+1))
+    knotx = w[interval*np.arange(1, num_knots+1)]
+    knotx.flags.writeable = False
+    q = spline_basis(w, knotx)
+    q.flags.writeable = False
+
+    return knotx, q
+
+
+def spline_basis(w, knotx, k=3):
+    """Builds an orthonormal basis for least-squares continuum fitting with a
+    cubic spline.
+
+    The boundary knots are placed at the ends of the wavelength scale, as in
+    LSQUnivariateSpline. The B-spline design matrix is orthonormalized by a QR
+    decomposition, so the least-squares spline through y is simply
+    q.T.dot(q.dot(y)).
+
+    Args:
+        w (np.ndarray): Wavelength scale
+        knotx (np.ndarray): Interior knot positions
+        k (int, optional): Spline degree
+    Returns:
+        q (np.ndarray): Orthonormal basis of shape
+            (len(knotx) + k + 1, len(w))
+    """
+    t = np.r_[[w[0]] * (k + 1), knotx, [w[-1]] * (k + 1)]
+    design = BSpline.design_matrix(w, t, k).toarray()
+    q, r = np.linalg.qr(design)
+
+    return np.ascontiguousarray(q.T)
+
+
+def convolve_reflect(arr, kernel, method='auto'):
+    """Convolves an array with a kernel along the last axis.
+
+    The edges are treated in the same manner as scipy.ndimage.convolve1d
+    (mode='reflect'), and the output has the same shape as the input.
+
+    Args:
+        arr (np.ndarray): Array to convolve
+        kernel (np.ndarray): Convolution kernel with an odd number of points.
+            Must have the same number of dimensions as arr, with any leading
+            axes broadcastable against those of arr.
+        method (str, optional): 'oa' for overlap-add FFT convolution, best for
+            a single short kernel on a long spectrum. 'fft' transforms each
+            row in one piece with a shared transform length, which is faster
+            when convolving a large stack of spectra at once. 'direct' uses a
+            compiled direct convolution (requires numba), fastest for short
+            spectra. 'auto' picks 'direct' if numba is installed, the
+            kernel has a single row and arr has fewer than DIRECT_CONV_MAX
+            elements in total, and 'oa' otherwise.
+    Returns:
+        np.ndarray: Convolved array
+    """
+    pad = kernel.shape[-1] // 2
+    widths = [(0, 0)] * (arr.ndim - 1) + [(pad, pad)]
+    padded = np.pad(arr, widths, mode='symmetric')
+
+    if method == 'auto':
+        if numba is not None and arr.size < DIRECT_CONV_MAX \
+                and kernel.size == kernel.shape[-1]:
+            method = 'direct'
+        else:
+            method = 'oa'
+
+    if method == 'oa':
+        return oaconvolve(padded, kernel, mode='valid', axes=-1)
+    elif method == 'fft':
+        n = padded.shape[-1]
+        nfft = sp_fft.next_fast_len(n + 2 * pad, real=True)
+        conv = sp_fft.irfft(sp_fft.rfft(padded, nfft, axis=-1) *
+                            sp_fft.rfft(kernel, nfft, axis=-1),
+                            nfft, axis=-1)
+        return conv[..., 2 * pad:n]
+    elif method == 'direct':
+        if numba is None:
+            raise ImportError("method='direct' requires numba")
+        padded = padded.reshape(-1, padded.shape[-1])
+        out = np.empty((padded.shape[0], arr.shape[-1]))
+        _direct_convolve(padded, np.ascontiguousarray(kernel.ravel(),
+                                                      dtype=np.float64), out)
+        return out.reshape(arr.shape)
+    else:
+        raise ValueError("method must be 'auto', 'oa', 'fft' or 'direct'")
+
+
+if numba is not None:
+    @numba.njit(cache=True, fastmath=True)
+    def _direct_convolve(padded, kernel, out):
+        """Direct 'valid' convolution of each row of padded with kernel,
+        written into out.
+        """
+        n = kernel.shape[0]
+        for i in range(out.shape[0]):
+            for j in range(out.shape[1]):
+                acc = 0.0
+                for k in range(n):
+                    acc += padded[i, j + k] * kernel[n - 1 - k]
+                out[i, j] = acc
+
+
 def add_spline_positions(params, knotx):
     """Adds spline positions to the parameter list.
 
@@ -8,10 +8,21 @@ import numpy as np
 from astropy import constants as c
 from astropy import units as u
 
+# Physical constants as plain floats, to avoid Quantity overhead
+G_CGS = c.G.cgs.value
+R_SUN_CGS = c.R_sun.cgs.value
+M_SUN_CGS = c.M_sun.cgs.value
+R_SUN_M = c.R_sun.si.value
+PC_M = u.pc.to(u.m)
+MAS_RAD = u.mas.to(u.rad)
+
 
 def calc_logg(radius, u_radius, mass, u_mass):
     """Calculates logg for a star from its mass and radius
 
+    Works elementwise on arrays, so logg can be computed for a whole catalog
+    in one call.
+
     Args:
         radius: in Rsun
         u_radius: Uncertainty in radius
@@ -22,12 +33,15 @@ def calc_logg(radius, u_radius, mass, u_mass):
         logg: in CGS
         u_logg: Propagated uncertainty
     """
-    rstar = radius * c.R_sun
-    mstar = mass * c.M_sun
-    g = (c.G * mstar/(rstar**2)).cgs.value
+    radius = np.asarray(radius, dtype=float)
+    u_radius = np.asarray(u_radius, dtype=float)
+    mass = np.asarray(mass, dtype=float)
+    u_mass = np.asarray(u_mass, dtype=float)
+
+    g = G_CGS * mass * M_SUN_CGS / (radius * R_SUN_CGS)**2
     logg = np.log10(g)
-    # Fractional error in g
-    u_frac_g = np.sqrt((u_mass/mass)**2 + 2*(u_radius/radius)**2)
+    # Fractional error in g = G M / R^2
+    u_frac_g = np.sqrt((u_mass/mass)**2 + (2*u_radius/radius)**2)
     # delta log_g = (1 / ln 10) * (delta g / g)
     u_logg = u_frac_g / np.log(10)
 
@@ -37,6 +51,38 @@ def calc_logg(radius, u_radius, mass, u_mass):
 def calc_radius(plx, u_plx, theta, u_theta):
     """Calculates stellar radius from parallax and angular diameter
 
+    Works elementwise on arrays. See calc_radius_units for a version using
+    astropy units.
+
+    Args:
+        plx: Parallax in mas
+        u_plx: Uncertainty in parallax
+        theta: Angular diameter in mas
+        u_theta: Uncertainty in angular diameter
+
+    Returns:
+        radius: in Rsun
+        u_radius: Uncertainty in radius
+    """
+    plx = np.asarray(plx, dtype=float)
+    u_plx = np.asarray(u_plx, dtype=float)
+    theta = np.asarray(theta, dtype=float)
+    u_theta = np.asarray(u_theta, dtype=float)
+
+    # convert units
+    dist = 1000. * PC_M / plx
+    theta_rad = theta * MAS_RAD
+
+    radius = dist * theta_rad / 2 / R_SUN_M
+    u_radius = (u_plx/plx + u_theta/theta) * radius
+
+    return radius, u_radius
+
+
+def calc_radius_units(plx, u_plx, theta, u_theta):
+    """Calculates stellar radius from parallax and angular diameter, using
+    astropy units for the conversions.
+
     Args:
         plx: Parallax in mas
         u_plx: Uncertainty in parallax